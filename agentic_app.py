@@ -1,16 +1,16 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
-import plotly.graph_objects as go
 import os
 import json
-import base64
+import orjson
+import hashlib
+import re
 from datetime import datetime, timedelta
-from tempfile import NamedTemporaryFile
-from phi.agent import Agent
-from phi.model.google import Gemini
-from phi.tools.tavily import TavilyTools
 from constants import SYSTEM_PROMPT, INSTRUCTIONS
+from indicators import compute_all_indicators, data_fingerprint, select_indicators, summarize_indicators
+from market_data import download_stock_data
+from charts import build_figure, figure_to_png
+from symbols import parse_tickers
 
 # Streamlit Page Config
 st.set_page_config(page_title="AI-Powered Technical Stock Analysis Dashboard", layout="wide")
@@ -19,16 +19,21 @@ st.set_page_config(page_title="AI-Powered Technical Stock Analysis Dashboard", l
 os.environ['TAVILY_API_KEY'] = st.secrets['TAVILY_API_KEY']
 os.environ['GOOGLE_API_KEY'] = st.secrets['GOOGLE_API_KEY']
 
-# Initialize AI Agent and store in session state
-if "agent" not in st.session_state:
-    st.session_state["agent"] = Agent(
-        model=Gemini(id="gemini-2.0-flash-exp"),
-        system_prompt=SYSTEM_PROMPT,
-        instructions=INSTRUCTIONS,
-        tools=[TavilyTools(api_key=os.getenv("TAVILY_API_KEY"))],
-        markdown=True,
-    )
-agent = st.session_state["agent"]
+# Initialize AI Agent on first use and store it in session state; phi imports are deferred until then.
+# One agent per session, since an Agent keeps memory and run state that must not be shared between users.
+def get_agent():
+    if "agent" not in st.session_state:
+        from phi.agent import Agent
+        from phi.model.google import Gemini
+        from phi.tools.tavily import TavilyTools
+        st.session_state["agent"] = Agent(
+            model=Gemini(id="gemini-2.0-flash-exp"),
+            system_prompt=SYSTEM_PROMPT,
+            instructions=INSTRUCTIONS,
+            tools=[TavilyTools(api_key=os.getenv("TAVILY_API_KEY"))],
+            markdown=True,
+        )
+    return st.session_state["agent"]
 
 # Streamlit UI
 st.title("AI-Powered Technical Stock Analysis Dashboard")
@@ -36,7 +41,9 @@ st.sidebar.header("Configuration")
 
 # User Input for Stocks
 tickers_input = st.sidebar.text_input("Enter Stock Tickers (comma-separated):", "AAPL,MSFT,GOOG")
-tickers = [ticker.strip().upper() for ticker in tickers_input.split(",") if ticker.strip()]
+tickers, rejected_tickers = parse_tickers(tickers_input)
+if rejected_tickers:
+    st.sidebar.warning(f"Skipping invalid tickers: {', '.join(rejected_tickers)}")
 
 # Date Range Selection
 end_date_default = datetime.today()
@@ -54,15 +61,15 @@ indicators = st.sidebar.multiselect(
 
 # Fetch Data Button
 if st.sidebar.button("Fetch Data"):
-    stock_data = {}
-    for ticker in tickers:
-        data = yf.download(ticker, start=start_date, end=end_date)
-        if not data.empty:
-            stock_data[ticker] = data
-        else:
+    # yfinance's batched download raises on an empty ticker list, so skip the request entirely
+    if not tickers:
+        st.warning("Please enter at least one valid ticker.")
+    else:
+        stock_data, missing = download_stock_data(tickers, start_date, end_date)
+        for ticker in missing:
             st.warning(f"No data found for {ticker}.")
-    st.session_state["stock_data"] = stock_data
-    st.success("Stock data loaded successfully for: " + ", ".join(stock_data.keys()))
+        st.session_state["stock_data"] = stock_data
+        st.success("Stock data loaded successfully for: " + ", ".join(stock_data.keys()))
 
 # Ensure Data is Available Before Analysis
 if "stock_data" in st.session_state and st.session_state["stock_data"]:
@@ -70,65 +77,116 @@ if "stock_data" in st.session_state and st.session_state["stock_data"]:
     tabs = st.tabs(tab_names)
     overall_results = []
 
-    # Analysis Function
-    def analyze_ticker(ticker, data):
-        fig = go.Figure(data=[go.Candlestick(x=data.index, open=data['Open'], high=data['High'],
-                                             low=data['Low'], close=data['Close'], name="Candlestick")])
-        
-        for ind in indicators:
-            if ind == "20-Day SMA":
-                fig.add_trace(go.Scatter(x=data.index, y=data['Close'].rolling(window=20).mean(),
-                                         mode='lines', name='SMA (20)'))
-            elif ind == "20-Day EMA":
-                fig.add_trace(go.Scatter(x=data.index, y=data['Close'].ewm(span=20).mean(),
-                                         mode='lines', name='EMA (20)'))
-            elif ind == "20-Day Bollinger Bands":
-                sma = data['Close'].rolling(window=20).mean()
-                std = data['Close'].rolling(window=20).std()
-                fig.add_trace(go.Scatter(x=data.index, y=sma + 2 * std, mode='lines', name='BB Upper'))
-                fig.add_trace(go.Scatter(x=data.index, y=sma - 2 * std, mode='lines', name='BB Lower'))
-            elif ind == "VWAP":
-                data['VWAP'] = (data['Close'] * data['Volume']).cumsum() / data['Volume'].cumsum()
-                fig.add_trace(go.Scatter(x=data.index, y=data['VWAP'], mode='lines', name='VWAP'))
-        
-        fig.update_layout(xaxis_rangeslider_visible=False)
-        
-        # Save chart as temp image
-        with NamedTemporaryFile(suffix=".png", delete=False) as tmpfile:
-            fig.write_image(tmpfile.name)
-            tmpfile_path = tmpfile.name
-        with open(tmpfile_path, "rb") as f:
-            image_bytes = f.read()
-        os.remove(tmpfile_path)
-
-        # Convert image bytes to base64 before passing to agent.run()
-        image_base64 = base64.b64encode(image_bytes).decode("utf-8")
-
-        # AI Analysis with Tavily-enhanced insights
-        with st.spinner(f'Analyzing {ticker}...'):
-            response = agent.run(
-                f"Analyze the stock chart for {ticker} and provide insights on trends, signals, and patterns.",
-                images=[{"mime_type": "image/png", "data": image_base64}]
-            )
-        
-        return fig, response.content
-
-    # Generate Results
-    for i, ticker in enumerate(st.session_state["stock_data"]):
-        data = st.session_state["stock_data"][ticker]
-        fig, analysis = analyze_ticker(ticker, data)
-        overall_results.append({"Stock": ticker, "Analysis": analysis})
-        
-        with tabs[i + 1]:
-            st.subheader(f"Analysis for {ticker}")
-            st.plotly_chart(fig)
+    # AI Analysis, cached per (ticker, chart image, technicals) so identical charts don't hit Gemini twice.
+    # Agent calls run serially on the script thread: a phi Agent is stateful and not thread-safe.
+    @st.cache_data(show_spinner=False)
+    def run_analysis(ticker, summary_json, image_digest, _image_bytes):
+        response = get_agent().run(
+            f"Analyze the stock chart for {ticker} and provide insights on trends, signals, and patterns. "
+            f"Key technicals for the latest bar (JSON): {summary_json}",
+            # Raw PNG bytes, no base64: the phidata Gemini model accepts bytes images directly (phidata >= 2.7)
+            images=[_image_bytes]
+        )
+        # Raise on an empty reply so st.cache_data doesn't keep it and Analyze can be retried
+        if not response.content:
+            raise ValueError("The agent returned an empty response")
+        return response.content
+
+    # Batched AI Analysis: one agent call for several tickers from their key technicals; returns ticker -> insights
+    @st.cache_data(show_spinner=False)
+    def run_batch_analysis(tickers, summaries_json):
+        response = get_agent().run(
+            f"Analyze the following tickers from their key technicals for the latest bar (JSON): {summaries_json}. "
+            f"Return a JSON array with one object per ticker and keys 'ticker', 'action' and 'justification'."
+        )
+        result_text = response.content or ""
+        # Extract the JSON array of objects, from the first '[{' to the last '}]': the agent may wrap it in
+        # a Markdown fence and surround it with links or citations like [1]. Failures raise so
+        # st.cache_data doesn't keep them and Analyze All can retry.
+        json_match = re.search(r"\[\s*\{.*\}\s*\]", result_text, re.DOTALL)
+        if json_match is None:
+            raise ValueError(f"No valid JSON array found in the response\n\n{result_text}")
+        try:
+            items = orjson.loads(json_match.group())
+            return {item["ticker"]: f"**{item['action']}**\n\n{item['justification']}" for item in items}
+        except (orjson.JSONDecodeError, KeyError, TypeError) as e:
+            raise ValueError(f"Error parsing AI response: {e}\n\n{result_text}") from e
+
+    # Technical Indicators for all tickers in one parallel pass (cached)
+    indicator_arrays = compute_all_indicators(st.session_state["stock_data"])
+
+    # Chart Function
+    def build_chart(ticker, data):
+        precomputed = select_indicators(indicator_arrays[ticker], indicators)
+        return build_figure(data, precomputed)
+
+    # Arguments for run_analysis (small chart PNG plus key technicals)
+    def analysis_request(ticker, data, fig):
+        # Render chart to PNG bytes in memory
+        image_bytes = figure_to_png(fig)
+        summary_json = json.dumps(summarize_indicators(ticker, data, indicator_arrays[ticker]))
+        return ticker, summary_json, hashlib.sha1(image_bytes).hexdigest(), image_bytes
+
+    # AI results are kept in session state per data fingerprint, so indicator toggles don't drop them
+    def analysis_key(ticker, data):
+        return f"analysis_{ticker}_{data_fingerprint(data)}"
+
+    # Ticker Tab (fragment: the Analyze button reruns only this tab)
+    @st.fragment
+    def render_ticker(ticker, data):
+        fig = build_chart(ticker, data)
+        st.subheader(f"Analysis for {ticker}")
+        st.plotly_chart(fig)
+        key = analysis_key(ticker, data)
+        if st.button("Analyze", key=f"an_{ticker}"):
+            with st.spinner(f'Analyzing {ticker}...'):
+                try:
+                    st.session_state[key] = run_analysis(*analysis_request(ticker, data, fig))
+                except Exception as e:
+                    # Not stored, so pressing Analyze again retries
+                    st.error(f"Analysis failed: {e}")
+                else:
+                    # Rerun the whole page so the Summary Table picks up the new insights
+                    st.rerun(scope="app")
+        if key in st.session_state:
             st.write("**Detailed AI Insights:**")
-            st.markdown(analysis)
-    
-    # Display Summary Table
+            st.markdown(st.session_state[key])
+        else:
+            st.info("Click Analyze to get AI insights for this chart.")
+
+    # Display Summary Table (with an explicit button to analyze every pending ticker)
     with tabs[0]:
         st.subheader("Overall AI-Powered Insights")
+        if st.button("Analyze All"):
+            pending = {
+                ticker: data for ticker, data in st.session_state["stock_data"].items()
+                if analysis_key(ticker, data) not in st.session_state
+            }
+            if pending:
+                # One batched agent call covers every pending ticker
+                summaries_json = json.dumps([summarize_indicators(ticker, data, indicator_arrays[ticker]) for ticker, data in pending.items()])
+                with st.spinner(f'Analyzing {", ".join(pending)}...'):
+                    try:
+                        results = run_batch_analysis(tuple(pending), summaries_json)
+                    except Exception as e:
+                        # Nothing is stored, so every pending ticker stays pending and can be retried
+                        st.error(f"Analysis failed: {e}")
+                        results = {}
+                missing = [ticker for ticker in pending if ticker not in results]
+                for ticker, data in pending.items():
+                    if ticker in results:
+                        st.session_state[analysis_key(ticker, data)] = results[ticker]
+                if missing:
+                    st.warning(f"No insights returned for: {', '.join(missing)}")
+
+        for ticker, data in st.session_state["stock_data"].items():
+            overall_results.append({"Stock": ticker, "Analysis": st.session_state.get(analysis_key(ticker, data), "Not analyzed")})
         df_summary = pd.DataFrame(overall_results)
         st.table(df_summary)
+
+    # Ticker Tabs
+    for i, (ticker, data) in enumerate(st.session_state["stock_data"].items()):
+        with tabs[i + 1]:
+            render_ticker(ticker, data)
 else:
     st.info("Please fetch stock data using the sidebar.")
@@ -3,23 +3,31 @@
 
 # Libraries
 import streamlit as st
-import yfinance as yf
 import pandas as pd
-import plotly.graph_objects as go
-import google.generativeai as genai
-import tempfile
 import os
 import json
+import orjson
+import hashlib
+import re
 from datetime import datetime, timedelta
+from indicators import compute_all_indicators, data_fingerprint, select_indicators, summarize_indicators
+from market_data import download_stock_data
+from charts import build_figure, figure_to_png
+from symbols import parse_tickers
 
 # Configure the API key - IMPORTANT: Use Streamlit secrets or environment variables for security
 os.environ['GOOGLE_API_KEY'] = st.secrets['GOOGLE_API_KEY']
 GOOGLE_API_KEY = os.environ['GOOGLE_API_KEY']
-genai.configure(api_key=GOOGLE_API_KEY)
 
 # Select the Gemini model - using 'gemini-2.0-flash' as a general-purpose model
 MODEL_NAME = 'gemini-1.5-flash' # or other model
-gen_model = genai.GenerativeModel(MODEL_NAME)
+
+# Create the Gemini client on first use and share it across sessions; the SDK import is deferred until then
+@st.cache_resource
+def get_model():
+    import google.generativeai as genai
+    genai.configure(api_key=GOOGLE_API_KEY)
+    return genai.GenerativeModel(MODEL_NAME)
 
 # Set up Streamlit app
 st.set_page_config(layout="wide")
@@ -28,8 +36,10 @@ st.sidebar.header("Configuration")
 
 # Input for multiple stock tickers (comma-separated)
 tickers_input = st.sidebar.text_input("Enter Stock Tickers (comma-separated):", "AAPL,MSFT,GOOG")
-# Parse tickers by stripping extra whitespace and splitting on commas
-tickers = [ticker.strip().upper() for ticker in tickers_input.split(",") if ticker.strip()]
+# Parse tickers by stripping extra whitespace and splitting on commas; invalid symbols are skipped before any download
+tickers, rejected_tickers = parse_tickers(tickers_input)
+if rejected_tickers:
+    st.sidebar.warning("Skipping invalid tickers: " + ", ".join(rejected_tickers))
 
 # Set the date range: start date = one year before today, end date = today
 end_date_default = datetime.today()
@@ -47,67 +57,25 @@ indicators = st.sidebar.multiselect(
 
 # Button to fetch data for all tickers
 if st.sidebar.button("Fetch Data"):
-    stock_data = {}
-    for ticker in tickers:
-        # Download data for each ticker using yfinance
-        data = yf.download(ticker, start=start_date, end=end_date)
-        if not data.empty:
-            stock_data[ticker] = data
-        else:
+    # yfinance's batched download raises on an empty ticker list, so skip the request entirely
+    if not tickers:
+        st.warning("Please enter at least one valid ticker.")
+    else:
+        stock_data, missing = download_stock_data(tickers, start_date, end_date)
+        for ticker in missing:
             st.warning(f"No data found for {ticker}.")
-    st.session_state["stock_data"] = stock_data
-    st.success("Stock data loaded successfully for: " + ", ".join(stock_data.keys()))
+        st.session_state["stock_data"] = stock_data
+        st.success("Stock data loaded successfully for: " + ", ".join(stock_data.keys()))
 
 # Ensure we have data to analyze
 if "stock_data" in st.session_state and st.session_state["stock_data"]:
 
-    # Define a function to build chart, call the Gemini API and return structured result
-    def analyze_ticker(ticker, data):
-        # Build candlestick chart for the given ticker's data
-        fig = go.Figure(data=[
-            go.Candlestick(
-                x=data.index,
-                open=data['Open'],
-                high=data['High'],
-                low=data['Low'],
-                close=data['Close'],
-                name="Candlestick"
-            )
-        ])
-
-        # Add selected technical indicators
-        def add_indicator(indicator):
-            if indicator == "20-Day SMA":
-                sma = data['Close'].rolling(window=20).mean()
-                fig.add_trace(go.Scatter(x=data.index, y=sma, mode='lines', name='SMA (20)'))
-            elif indicator == "20-Day EMA":
-                ema = data['Close'].ewm(span=20).mean()
-                fig.add_trace(go.Scatter(x=data.index, y=ema, mode='lines', name='EMA (20)'))
-            elif indicator == "20-Day Bollinger Bands":
-                sma = data['Close'].rolling(window=20).mean()
-                std = data['Close'].rolling(window=20).std()
-                bb_upper = sma + 2 * std
-                bb_lower = sma - 2 * std
-                fig.add_trace(go.Scatter(x=data.index, y=bb_upper, mode='lines', name='BB Upper'))
-                fig.add_trace(go.Scatter(x=data.index, y=bb_lower, mode='lines', name='BB Lower'))
-            elif indicator == "VWAP":
-                data['VWAP'] = (data['Close'] * data['Volume']).cumsum() / data['Volume'].cumsum()
-                fig.add_trace(go.Scatter(x=data.index, y=data['VWAP'], mode='lines', name='VWAP'))
-        for ind in indicators:
-            add_indicator(ind)
-        fig.update_layout(xaxis_rangeslider_visible=False)
-
-        # Save chart as temporary PNG file and read image bytes
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmpfile:
-            fig.write_image(tmpfile.name)
-            tmpfile_path = tmpfile.name
-        with open(tmpfile_path, "rb") as f:
-            image_bytes = f.read()
-        os.remove(tmpfile_path)
-
+    # Call the Gemini API once per (ticker, chart image, technicals); re-rendering an identical chart reuses the result
+    @st.cache_data(show_spinner=False)
+    def generate_analysis(ticker, summary_json, image_digest, _image_bytes):
         # Create an image Part
         image_part = {
-            "data": image_bytes,  
+            "data": _image_bytes,
             "mime_type": "image/png"
         }
 
@@ -115,6 +83,7 @@ if "stock_data" in st.session_state and st.session_state["stock_data"]:
         analysis_prompt = (
             f"You are a Stock Trader specializing in Technical Analysis at a top financial institution. "
             f"Analyze the stock chart for {ticker} based on its candlestick chart and the displayed technical indicators. "
+            f"Key technicals for the latest bar (JSON): {summary_json}. "
             f"Provide a detailed justification of your analysis, explaining what patterns, signals, and trends you observe. "
             f"Then, based solely on the chart, provide a recommendation from the following options: "
             f"'Strong Buy', 'Buy', 'Weak Buy', 'Hold', 'Weak Sell', 'Sell', or 'Strong Sell'. "
@@ -127,55 +96,132 @@ if "stock_data" in st.session_state and st.session_state["stock_data"]:
             {"role": "user", "parts": [image_part]}       # Image part with role "user"
         ]
 
-        response = gen_model.generate_content(
+        response = get_model().generate_content(
             contents=contents  # Pass the restructured 'contents' with roles
         )
 
+        # Find the start and end of the JSON object within the text (if Gemini includes extra text).
+        # Failures raise instead of returning an error result, since st.cache_data would keep it and
+        # pressing Analyze again could never retry.
+        result_text = response.text
+        json_start_index = result_text.find('{')
+        json_end_index = result_text.rfind('}') + 1  # +1 to include the closing brace
+        if json_start_index == -1 or json_end_index <= json_start_index:
+            raise ValueError(f"No valid JSON object found in the response. Raw response text: {result_text}")
         try:
-            # Attempt to parse JSON from the response text
-            result_text = response.text
-            # Find the start and end of the JSON object within the text (if Gemini includes extra text)
-            json_start_index = result_text.find('{')
-            json_end_index = result_text.rfind('}') + 1  # +1 to include the closing brace
-            if json_start_index != -1 and json_end_index > json_start_index:
-                json_string = result_text[json_start_index:json_end_index]
-                result = json.loads(json_string)
-            else:
-                raise ValueError("No valid JSON object found in the response")
-
-        except json.JSONDecodeError as e:
-            result = {"action": "Error", "justification": f"JSON Parsing error: {e}. Raw response text: {response.text}"}
-        except ValueError as ve:
-            result = {"action": "Error", "justification": f"Value Error: {ve}. Raw response text: {response.text}"}
-        except Exception as e:
-            result = {"action": "Error", "justification": f"General Error: {e}. Raw response text: {response.text}"}
-
-        return fig, result
+            return orjson.loads(result_text[json_start_index:json_end_index])
+        except orjson.JSONDecodeError as e:
+            raise ValueError(f"JSON Parsing error: {e}. Raw response text: {result_text}") from e
 
-    # Create tabs: first tab for overall summary, subsequent tabs per ticker
-    tab_names = ["Overall Summary"] + list(st.session_state["stock_data"].keys())
-    tabs = st.tabs(tab_names)
+    # Call the Gemini API once for several tickers, sending only their key technicals; returns ticker -> result
+    @st.cache_data(show_spinner=False)
+    def generate_batch_analysis(tickers, summaries_json):
+        analysis_prompt = (
+            f"You are a Stock Trader specializing in Technical Analysis at a top financial institution. "
+            f"Analyze each of the following tickers based on its key technicals for the latest bar (JSON): {summaries_json}. "
+            f"For each ticker, provide a detailed justification of your analysis, explaining what signals and trends you observe. "
+            f"Then provide a recommendation from the following options: "
+            f"'Strong Buy', 'Buy', 'Weak Buy', 'Hold', 'Weak Sell', 'Sell', or 'Strong Sell'. "
+            f"Return your output as a JSON array with one object per ticker and three keys: 'ticker', 'action' and 'justification'."
+        )
 
-    # List to store overall results
-    overall_results = []
+        response = get_model().generate_content(
+            contents=[{"role": "user", "parts": [analysis_prompt]}]
+        )
 
-    # Process each ticker and populate results
-    for i, ticker in enumerate(st.session_state["stock_data"]):
-        data = st.session_state["stock_data"][ticker]
-        # Analyze ticker: get chart figure and structured output result
-        fig, result = analyze_ticker(ticker, data)
-        overall_results.append({"Stock": ticker, "Recommendation": result.get("action", "N/A")})
-        # In each ticker-specific tab, display the chart and detailed justification
-        with tabs[i + 1]:
-            st.subheader(f"Analysis for {ticker}")
-            st.plotly_chart(fig)
+        # Find the JSON array of objects within the text: from the first '[{' to the last '}]', so citation
+        # brackets like [1] or Markdown links around it (if Gemini includes extra text) are skipped.
+        # Failures raise so st.cache_data doesn't keep them and Analyze All can retry.
+        result_text = response.text
+        json_match = re.search(r"\[\s*\{.*\}\s*\]", result_text, re.DOTALL)
+        if json_match is None:
+            raise ValueError(f"No valid JSON array found in the response. Raw response text: {result_text}")
+        try:
+            return {item["ticker"]: item for item in orjson.loads(json_match.group())}
+        except (orjson.JSONDecodeError, KeyError, TypeError) as e:
+            raise ValueError(f"JSON Parsing error: {e}. Raw response text: {result_text}") from e
+
+    # Compute all technical indicators for every ticker in one parallel pass (cached)
+    indicator_arrays = compute_all_indicators(st.session_state["stock_data"])
+
+    # Define a function to build the candlestick chart with the selected technical indicators
+    def build_chart(ticker, data):
+        precomputed = select_indicators(indicator_arrays[ticker], indicators)
+        return build_figure(data, precomputed)
+
+    # Render the chart to a small PNG and summarize its technicals: the arguments for generate_analysis
+    def analysis_request(ticker, data, fig):
+        image_bytes = figure_to_png(fig)
+        summary_json = json.dumps(summarize_indicators(ticker, data, indicator_arrays[ticker]))
+        return ticker, summary_json, hashlib.sha1(image_bytes).hexdigest(), image_bytes
+
+    # AI results live in session state keyed by data fingerprint, so toggling indicators keeps them
+    def analysis_key(ticker, data):
+        return f"analysis_{ticker}_{data_fingerprint(data)}"
+
+    # Each ticker tab is a fragment: clicking Analyze reruns only this tab, not the whole page
+    @st.fragment
+    def render_ticker(ticker, data):
+        fig = build_chart(ticker, data)
+        st.subheader(f"Analysis for {ticker}")
+        st.plotly_chart(fig)
+        key = analysis_key(ticker, data)
+        result = st.session_state.get(key)
+        if st.button("Analyze", key=f"an_{ticker}"):
+            with st.spinner(f"Analyzing {ticker}..."):
+                try:
+                    st.session_state[key] = generate_analysis(*analysis_request(ticker, data, fig))
+                except Exception as e:
+                    # Shown once but not stored, so pressing Analyze again retries
+                    st.error(f"Analysis failed: {e}")
+                else:
+                    # Rerun the whole page so the Overall Summary table picks up the new recommendation
+                    st.rerun(scope="app")
+        if result is None:
+            st.info("Click Analyze to get an AI recommendation for this chart.")
+        else:
             st.write("**Detailed Justification:**")
             st.write(result.get("justification", "No justification provided."))
 
-    # In the Overall Summary tab, display a table of all results
+    # Create tabs: first tab for overall summary, subsequent tabs per ticker
+    tab_names = ["Overall Summary"] + list(st.session_state["stock_data"].keys())
+    tabs = st.tabs(tab_names)
+
+    # In the Overall Summary tab, analyze all pending tickers on request and display a table of all results
     with tabs[0]:
         st.subheader("Overall Structured Recommendations")
+        if st.button("Analyze All"):
+            pending = {
+                ticker: data for ticker, data in st.session_state["stock_data"].items()
+                if analysis_key(ticker, data) not in st.session_state
+            }
+            if pending:
+                # One Gemini request covers every pending ticker
+                summaries_json = json.dumps([summarize_indicators(ticker, data, indicator_arrays[ticker]) for ticker, data in pending.items()])
+                with st.spinner("Analyzing " + ", ".join(pending) + "..."):
+                    try:
+                        results = generate_batch_analysis(tuple(pending), summaries_json)
+                    except Exception as e:
+                        # Nothing is stored, so every pending ticker stays pending and can be retried
+                        st.error(f"General Error: {e}")
+                        results = {}
+                missing = [ticker for ticker in pending if ticker not in results]
+                for ticker, data in pending.items():
+                    if ticker in results:
+                        st.session_state[analysis_key(ticker, data)] = results[ticker]
+                if missing:
+                    st.warning("No recommendation returned for: " + ", ".join(missing))
+
+        overall_results = []
+        for ticker, data in st.session_state["stock_data"].items():
+            result = st.session_state.get(analysis_key(ticker, data), {})
+            overall_results.append({"Stock": ticker, "Recommendation": result.get("action", "Not analyzed")})
         df_summary = pd.DataFrame(overall_results)
         st.table(df_summary)
+
+    # Render each ticker-specific tab
+    for i, (ticker, data) in enumerate(st.session_state["stock_data"].items()):
+        with tabs[i + 1]:
+            render_ticker(ticker, data)
 else:
     st.info("Please fetch stock data using the sidebar.")
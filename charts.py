@@ -0,0 +1,44 @@
+import functools
+
+import plotly.graph_objects as go
+import plotly.io as pio
+
+# Layout shared by every chart, validated once at import
+_BASE_LAYOUT = go.Layout(xaxis_rangeslider_visible=False)
+
+
+# Configure the long-lived kaleido scope on first export rather than at import, so Chromium only
+# starts once a chart is actually exported and a broken kaleido install only affects the Analyze
+# action. Exports are kept small (600x300) since they are only uploaded to the AI model; the
+# on-screen chart is unaffected.
+@functools.lru_cache(maxsize=None)
+def _kaleido_scope():
+    scope = pio.kaleido.scope
+    scope.default_format = 'png'
+    scope.default_width = 600
+    scope.default_height = 300
+    scope.default_scale = 1
+    return scope
+
+
+# Build the candlestick chart from a ticker's column arrays and overlay precomputed indicator series.
+# Traces are passed as plain dicts of NumPy arrays so the figure is assembled in a single batch.
+def build_figure(data, precomputed):
+    traces = [dict(
+        type='candlestick',
+        x=data['idx'],
+        open=data['o'],
+        high=data['h'],
+        low=data['l'],
+        close=data['c'],
+        name="Candlestick"
+    )]
+    for name, values in precomputed.items():
+        traces.append(dict(type='scatter', x=data['idx'], y=values, mode='lines', name=name))
+    return go.Figure(data=traces, layout=_BASE_LAYOUT)
+
+
+# Render a figure to PNG bytes on the shared kaleido scope
+def figure_to_png(fig):
+    _kaleido_scope()
+    return pio.to_image(fig, format='png', scale=1)
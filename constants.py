@@ -12,4 +12,5 @@ INSTRUCTIONS = """
 * Explain the reasoning behind your recommendation using candlestick formations and volume trends.
 * Consider market sentiment and historical price performance.
 * Use the Search tool to validate key financial data when necessary.
+* When asked to analyze several tickers at once, return only a JSON array with one object per ticker and keys "ticker", "action" and "justification".
 """
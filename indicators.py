@@ -0,0 +1,142 @@
+import numpy as np
+import streamlit as st
+from numba import njit, prange
+
+# Window used by every 20-day indicator
+WINDOW = 20
+
+
+# Single pass over close/volume writing SMA, rolling std, EMA and VWAP into the output slices.
+# Follows pandas semantics: SMA/std are NaN until the window holds WINDOW valid closes (so a NaN
+# close blanks them only until it leaves the window), std uses ddof=1, the EMA is the adjusted
+# ewm(span=...).mean() that decays across NaNs, and VWAP's cumulative sums skip NaNs.
+# The rolling variance uses running sums of squares, so values agree with pandas to
+# floating-point tolerance rather than bit-for-bit.
+@njit(cache=True, error_model='numpy')
+def _fill_indicators(close, vol, win, span, sma, std, ema, vwap):
+    s = 0.0
+    s2 = 0.0
+    n_nan = 0
+    decay = 1.0 - 2.0 / (span + 1.0)
+    num = 0.0
+    den = 0.0
+    cpv = 0.0
+    cv = 0.0
+    for i in range(close.size):
+        c = close[i]
+        if np.isnan(c):
+            n_nan += 1
+            num *= decay
+            den *= decay
+        else:
+            s += c
+            s2 += c * c
+            num = c + decay * num
+            den = 1.0 + decay * den
+        if i >= win:
+            old = close[i - win]
+            if np.isnan(old):
+                n_nan -= 1
+            else:
+                s -= old
+                s2 -= old * old
+        if i >= win - 1 and n_nan == 0:
+            mean = s / win
+            sma[i] = mean
+            std[i] = np.sqrt(max((s2 - s * mean) / (win - 1), 0.0))
+        ema[i] = num / den
+        v = vol[i]
+        pv = c * v
+        if not np.isnan(v):
+            cv += v
+        if not np.isnan(pv):
+            cpv += pv
+            vwap[i] = cpv / cv
+
+
+# Run the fused kernel for every ticker in parallel. Rows are padded to the longest
+# history; lens holds each ticker's real length.
+@njit(cache=True, parallel=True, error_model='numpy')
+def compute_all(closes, vols, lens, win, span):
+    sma = np.full(closes.shape, np.nan)
+    std = np.full(closes.shape, np.nan)
+    ema = np.full(closes.shape, np.nan)
+    vwap = np.full(closes.shape, np.nan)
+    for k in prange(closes.shape[0]):
+        m = lens[k]
+        _fill_indicators(closes[k, :m], vols[k, :m], win, span, sma[k, :m], std[k, :m], ema[k, :m], vwap[k, :m])
+    return sma, std, ema, vwap
+
+
+# Compile the kernels once at import so the first Fetch doesn't pay the JIT cost
+compute_all(np.zeros((1, WINDOW + 5)), np.ones((1, WINDOW + 5)), np.array([WINDOW + 5]), WINDOW, WINDOW)
+
+
+# Cheap fingerprint so the cache key doesn't require hashing every array
+def data_fingerprint(data):
+    return (data['c'].size, str(data['idx'][-1]), float(data['c'][-1]))
+
+
+@st.cache_data(show_spinner=False)
+def _compute_all_indicators(fingerprints, _stock_data):
+    tickers = list(_stock_data)
+    lens = np.array([_stock_data[t]['c'].size for t in tickers], dtype=np.int64)
+    closes = np.zeros((len(tickers), lens.max()))
+    vols = np.zeros((len(tickers), lens.max()))
+    for k, ticker in enumerate(tickers):
+        closes[k, :lens[k]] = _stock_data[ticker]['c']
+        vols[k, :lens[k]] = _stock_data[ticker]['v']
+    sma, std, ema, vwap = compute_all(closes, vols, lens, WINDOW, WINDOW)
+    return {
+        ticker: {'sma': sma[k, :lens[k]], 'std': std[k, :lens[k]], 'ema': ema[k, :lens[k]], 'vwap': vwap[k, :lens[k]]}
+        for k, ticker in enumerate(tickers)
+    }
+
+
+# Compute every indicator for every ticker in one parallel kernel call; reruns hit the cache.
+# Returns ticker -> {'sma', 'std', 'ema', 'vwap'} arrays.
+def compute_all_indicators(stock_data):
+    fingerprints = tuple((ticker, data_fingerprint(data)) for ticker, data in stock_data.items())
+    return _compute_all_indicators(fingerprints, stock_data)
+
+
+# Pick the selected indicators out of one ticker's precomputed arrays.
+# Returns trace name -> array, in the order the traces should be drawn.
+def select_indicators(arrays, indicators):
+    series = {}
+    for ind in indicators:
+        if ind == "20-Day SMA":
+            series['SMA (20)'] = arrays['sma']
+        elif ind == "20-Day EMA":
+            series['EMA (20)'] = arrays['ema']
+        elif ind == "20-Day Bollinger Bands":
+            series['BB Upper'] = arrays['sma'] + 2 * arrays['std']
+            series['BB Lower'] = arrays['sma'] - 2 * arrays['std']
+        elif ind == "VWAP":
+            series['VWAP'] = arrays['vwap']
+    return series
+
+
+# Last value of an indicator array as a JSON-friendly float (None while the window is filling)
+def _last(values):
+    value = float(values[-1])
+    return None if np.isnan(value) else value
+
+
+# Compact numeric snapshot of a ticker's latest technicals, sent to the AI alongside a small chart
+def summarize_indicators(ticker, data, arrays):
+    close = data['c']
+    vol = data['v']
+    upper = arrays['sma'][-1] + 2 * arrays['std'][-1]
+    lower = arrays['sma'][-1] - 2 * arrays['std'][-1]
+    vol_avg = vol[-WINDOW:].mean()
+    return {
+        'ticker': ticker,
+        'close': float(close[-1]),
+        'sma20': _last(arrays['sma']),
+        'ema20': _last(arrays['ema']),
+        'vwap': _last(arrays['vwap']),
+        'bb_pct': float((close[-1] - lower) / (upper - lower)) if upper > lower else None,
+        'vol_avg_ratio': float(vol[-1] / vol_avg) if vol_avg > 0 else None,
+        'last_20_closes': close[-WINDOW:].tolist(),
+    }
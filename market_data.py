@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+import yfinance as yf
+
+
+# Struct-of-arrays view of a yfinance frame: the datetime index plus contiguous float64 OHLCV columns.
+# Everything downstream of the download works on these arrays, never on pandas.
+def to_soa(df):
+    return {
+        'idx': df.index.to_numpy(),
+        'o': df['Open'].to_numpy(dtype=np.float64),
+        'h': df['High'].to_numpy(dtype=np.float64),
+        'l': df['Low'].to_numpy(dtype=np.float64),
+        'c': df['Close'].to_numpy(dtype=np.float64),
+        'v': df['Volume'].to_numpy(dtype=np.float64),
+    }
+
+
+# Download the given tickers in one batched request (yfinance fetches them on parallel threads).
+# Tickers with no data are left out: yfinance reports failures as empty frames, not exceptions.
+def _download_batch(tickers, start, end):
+    raw = yf.download(list(tickers), start=start, end=end, group_by='ticker', threads=True, progress=False)
+    stock_data = {}
+    for ticker in tickers:
+        if isinstance(raw.columns, pd.MultiIndex):
+            data = raw[ticker].dropna(how='all') if ticker in raw.columns.levels[0] else pd.DataFrame()
+        else:
+            # A single ticker comes back with flat columns
+            data = raw.dropna(how='all')
+        if not data.empty:
+            stock_data[ticker] = to_soa(data)
+    return stock_data
+
+
+# Per-ticker cache entry, filled from a batch download. A ticker without data raises, and
+# st.cache_data doesn't store calls that raise, so only tickers that actually have data are cached.
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_ticker_data(ticker, start, end, _downloaded):
+    if ticker not in _downloaded:
+        raise LookupError(ticker)
+    return _downloaded[ticker]
+
+
+# Fetch stock data for the tickers and date range. Cached tickers are served from memory; the rest
+# are downloaded in a single batch, so a typo or delisted symbol only re-downloads itself on the
+# next Fetch. Returns (ticker -> SoA dict, tickers with no data).
+def download_stock_data(tickers, start, end):
+    stock_data = {}
+    pending = []
+    for ticker in tickers:
+        try:
+            stock_data[ticker] = _cached_ticker_data(ticker, start, end, {})
+        except LookupError:
+            pending.append(ticker)
+
+    missing = []
+    if pending:
+        downloaded = _download_batch(pending, start, end)
+        for ticker in pending:
+            try:
+                stock_data[ticker] = _cached_ticker_data(ticker, start, end, downloaded)
+            except LookupError:
+                missing.append(ticker)
+    # Keep the requested ticker order
+    return {ticker: stock_data[ticker] for ticker in tickers if ticker in stock_data}, missing
@@ -0,0 +1,36 @@
+import os
+import re
+
+import pandas as pd
+import streamlit as st
+
+# Syntax check only: reject entries with inner whitespace or control characters. Yahoo symbols
+# use many punctuation forms (BRK-B, ^GSPC, EURUSD=X, M&M.NS, TATAMOTORS.NS), so anything stricter
+# would turn valid tickers away; whether a symbol exists is left to the symbol list.
+TICKER_PATTERN = re.compile(r"[^\s\x00-\x1f\x7f]+")
+
+# Optional local list of known symbols (CSV with a 'symbol' column)
+SYMBOLS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "symbols.csv")
+
+
+# Load the known-symbol set once per process; None when no list is shipped, which skips the check
+@st.cache_resource
+def valid_symbols():
+    if not os.path.exists(SYMBOLS_PATH):
+        return None
+    return frozenset(pd.read_csv(SYMBOLS_PATH)['symbol'].str.strip().str.upper())
+
+
+# Split the comma-separated input into (valid tickers, rejected entries) before any network call
+def parse_tickers(tickers_input):
+    known = valid_symbols()
+    tickers, rejected = [], []
+    for entry in tickers_input.split(","):
+        ticker = entry.strip().upper()
+        if not ticker:
+            continue
+        if TICKER_PATTERN.fullmatch(ticker) and (known is None or ticker in known):
+            tickers.append(ticker)
+        else:
+            rejected.append(ticker)
+    return tickers, rejected